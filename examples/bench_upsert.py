@@ -0,0 +1,41 @@
+import micropg
+import time
+
+### To Do: Fill in your server connection data
+conn = micropg.connect(host='127.0.0.1',
+                    user='postgres',
+                    password='123456',
+                    database='postgres')
+cur = conn.cursor()
+
+N = 10000
+
+cur.execute("DROP TABLE IF EXISTS bench_upsert")
+cur.execute("CREATE TABLE bench_upsert (id INT PRIMARY KEY, name VARCHAR(50), score INT)")
+conn.commit()
+
+
+def rows(n, k):
+    return [(i, 'name%d' % i, i * k) for i in range(n)]
+
+
+def bench(name, func, k):
+    start = time.time()
+    func(rows(N, k))
+    conn.commit()
+    print("%-12s %d rows %.3f sec" % (name, N, time.time() - start))
+
+
+sql = "INSERT INTO bench_upsert (id, name, score) VALUES (%s, %s, %s) ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, score = EXCLUDED.score"
+
+# insert, then update the same keys with each way
+for k in (1, 2):
+    bench("executemany", lambda r: cur.executemany(sql, r), k)
+    bench("bulk_upsert", lambda r: cur.bulk_upsert('bench_upsert', ['id', 'name', 'score'], r, ['id']), k + 1)
+
+cur.execute("SELECT count(*), sum(score) FROM bench_upsert")
+assert cur.fetchone() == (N, sum([i * 3 for i in range(N)]))
+
+cur.execute("DROP TABLE bench_upsert")
+conn.commit()
+conn.close()
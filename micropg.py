@@ -127,22 +127,33 @@ PG_TYPE_FDW_HANDLER = 3115
 PG_TYPE_JSONBOID = 3802
 PG_TYPE_ANYRANGE = 3831
 
+# ssl.SSLContext used when use_ssl is True, and TLS sessions by (context, address)
+_default_ssl_context = None
+_ssl_sessions = {}
+_ssl_sessions_max = 64
 
-def hmac_sha256_digest(key, msg):
-    pad_key = key + b'\x00' * (64 - (len(key) % 64))
-    ik = bytes([0x36 ^ b for b in pad_key])
-    ok = bytes([0x5c ^ b for b in pad_key])
+
+def _hmac_sha256_pads(key):
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    pad_key = key + b'\x00' * (64 - len(key))
+    return bytes([0x36 ^ b for b in pad_key]), bytes([0x5c ^ b for b in pad_key])
+
+
+def hmac_sha256_digest(key, msg, pads=None):
+    ik, ok = pads if pads else _hmac_sha256_pads(key)
     return hashlib.sha256(ok + hashlib.sha256(ik+msg).digest()).digest()
 
 
 def pbkdf2_hmac_sha256(password_bytes, salt, iterations):
     # hashlib.pbkdf2_hmac('sha256', password_bytes, salt, iterations)
-    _u1 = hmac_sha256_digest(password_bytes, salt+b'\x00\x00\x00\x01')
+    pads = _hmac_sha256_pads(password_bytes)
+    _u1 = hmac_sha256_digest(password_bytes, salt+b'\x00\x00\x00\x01', pads)
 
     _ui = int.from_bytes(_u1, 'big')
 
     for _ in range(iterations - 1):
-        _u1 = hmac_sha256_digest(password_bytes, _u1)
+        _u1 = hmac_sha256_digest(password_bytes, _u1, pads)
         _ui ^= int.from_bytes(_u1, 'big')
 
     return _ui.to_bytes(32, 'big')
@@ -270,10 +281,371 @@ class NotSupportedError(DatabaseError):
         DatabaseError.__init__(self, 'NotSupportedError')
 
 
+class Row(object):
+    # A row sharing one column name to index map with the other rows of the result.
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, k):
+        if isinstance(k, str):
+            return self._values[self._index[k]]
+        return self._values[k]
+
+    def __getattr__(self, name):
+        # private names are not columns, copy and pickle look them up before the slots are set
+        if name[:1] == '_':
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            other = other._values
+        elif isinstance(other, LazyRow):
+            other = tuple(other)
+        elif not isinstance(other, tuple):
+            return False
+        return self._values == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        return 'Row(' + ', '.join(['%s=%r' % (k, self._values[i]) for k, i in self._index.items()]) + ')'
+
+    def keys(self):
+        return list(self._index)
+
+
+def compact_row(cursor):
+    index = {}
+    for i in range(len(cursor.description)):
+        index[cursor.description[i][0]] = i
+
+    def make_row(values):
+        return Row(index, tuple(values))
+    return make_row
+
+
+def dict_row(cursor):
+    names = [d[0] for d in cursor.description]
+
+    def make_row(values):
+        return dict(zip(names, values))
+    return make_row
+
+
+def _is_read_query(query):
+    # a query without locks or side effects the cache may answer
+    s = query.upper()
+    for c in '(),;.\'"':
+        s = s.replace(c, ' ')
+    words = s.split()
+    if not words or words[0] not in ('SELECT', 'VALUES', 'TABLE', 'SHOW'):
+        return False
+    for w in words:
+        if w in _VOLATILE_WORDS:
+            return False
+        for prefix in _VOLATILE_PREFIXES:
+            if w.startswith(prefix):
+                return False
+    return True
+
+
+# locking clauses and functions with side effects or changing results
+_VOLATILE_WORDS = (
+    'INTO', 'UPDATE', 'SHARE', 'NEXTVAL', 'SETVAL', 'CURRVAL', 'LASTVAL', 'SET_CONFIG', 'PG_NOTIFY',
+    'NOW', 'RANDOM', 'SETSEED', 'GEN_RANDOM_UUID', 'CLOCK_TIMESTAMP', 'STATEMENT_TIMESTAMP', 'TIMEOFDAY',
+    'TRANSACTION_TIMESTAMP', 'CURRENT_TIMESTAMP', 'CURRENT_TIME', 'CURRENT_DATE', 'LOCALTIME', 'LOCALTIMESTAMP',
+    'PG_SLEEP', 'PG_RELOAD_CONF', 'PG_CANCEL_BACKEND', 'PG_TERMINATE_BACKEND',
+)
+_VOLATILE_PREFIXES = (
+    'LO_', 'LOREAD', 'LOWRITE', 'TXID_', 'PG_ADVISORY', 'PG_TRY_ADVISORY', 'PG_CURRENT_', 'PG_CREATE_', 'PG_DROP_',
+    'PG_SWITCH_', 'PG_LOGICAL_', 'PG_REPLICATION_', 'UUID_GENERATE',
+)
+
+
+def _copy_rows(rows):
+    # dict rows are mutable and copied in and out of the cache
+    return [dict(r) if isinstance(r, dict) else r for r in rows]
+
+
+class QueryCache(object):
+    # Cache of SELECT results shared by cursors, size bounded with LRU eviction.
+    def __init__(self, max_bytes=1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = {}
+        self._clock = 0
+        try:
+            import _thread
+            self._lock = _thread.allocate_lock()
+        except ImportError:
+            self._lock = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _acquire(self):
+        if self._lock:
+            self._lock.acquire()
+
+    def _release(self):
+        if self._lock:
+            self._lock.release()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+
+    def get(self, key):
+        import time
+        self._acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            entry[6] = self._clock
+            return entry[2], entry[3], entry[4]
+        finally:
+            self._release()
+
+    def put(self, key, description, rows, rowcount, channels=(), ttl=None):
+        import time
+        size = 64 + len(key[1])
+        for row in rows:
+            size += 16
+            if isinstance(row, LazyRow):
+                size += len(row._data)
+                continue
+            for v in (row.values() if isinstance(row, dict) else row):
+                size += len(v) if isinstance(v, (str, bytes)) else 8
+        if size > self.max_bytes:
+            return
+        self._acquire()
+        try:
+            if key in self._entries:
+                self._remove(key)
+            while self.size + size > self.max_bytes:
+                lru = None
+                for k, entry in self._entries.items():
+                    if lru is None or entry[6] < lru[1]:
+                        lru = (k, entry[6])
+                self._remove(lru[0])
+            self._clock += 1
+            self._entries[key] = [
+                time.time() + (self.ttl if ttl is None else ttl),
+                size, description, tuple(_copy_rows(rows)), rowcount, tuple(channels), self._clock
+            ]
+            self.size += size
+        finally:
+            self._release()
+
+    def invalidate(self, channel=None, source=None):
+        # the results notified on channel and/or of the (host, port, database, user) source
+        self._acquire()
+        try:
+            for key in [
+                k for k, entry in self._entries.items()
+                if (channel is None or channel in entry[5]) and (source is None or k[0] == source)
+            ]:
+                self._remove(key)
+        finally:
+            self._release()
+
+    def clear(self):
+        self.invalidate()
+
+
+_UNDECODED = object()
+
+
+class LazyRow(object):
+    # A row keeping the DataRow message, columns are decoded when accessed.
+    __slots__ = ('_result', '_data', '_offsets', '_values')
+
+    def __init__(self, result, data):
+        self._result = result       # (column name to index map, type oids, encoding)
+        self._data = data
+        self._offsets = None
+        self._values = None
+
+    def _get(self, i):
+        if self._offsets is None:
+            offsets = []
+            data = self._data
+            n = 2
+            while n < len(data):
+                if data[n:n+4] == b'\xff\xff\xff\xff':
+                    offsets.append((n + 4, -1))
+                    n += 4
+                else:
+                    ln = _bytes_to_bint(data[n:n+4])
+                    offsets.append((n + 4, ln))
+                    n += 4 + ln
+            self._offsets = offsets
+            self._values = [_UNDECODED] * len(offsets)
+        v = self._values[i]
+        if v is _UNDECODED:
+            n, ln = self._offsets[i]
+            v = None if ln < 0 else _decode_column(self._data[n:n+ln], self._result[1][i], self._result[2])
+            self._values[i] = v
+        return v
+
+    def __getitem__(self, k):
+        if isinstance(k, str):
+            return self._get(self._result[0][k])
+        if isinstance(k, slice):
+            return tuple([self._get(i) for i in range(len(self))[k]])
+        if k < 0:
+            k += len(self)
+        return self._get(k)
+
+    def __getattr__(self, name):
+        # private names are not columns, copy and pickle look them up before the slots are set
+        if name[:1] == '_':
+            raise AttributeError(name)
+        try:
+            return self._get(self._result[0][name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self._result[1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        if not isinstance(other, (tuple, Row, LazyRow)):
+            return False
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'LazyRow(' + ', '.join(['%s=%r' % (k, self._get(i)) for k, i in self._result[0].items()]) + ')'
+
+    def keys(self):
+        return list(self._result[0])
+
+
+def lazy_row(cursor):
+    index = {}
+    for i in range(len(cursor.description)):
+        index[cursor.description[i][0]] = i
+    result = (index, [d[1] for d in cursor.description], cursor.connection.encoding)
+
+    def make_row(data):
+        return LazyRow(result, data)
+    return make_row
+
+
+def _literal_text(connection, v):
+    # text of a value for COPY from its literal by escape_parameter(), None for NULL
+    t = type(v)
+    if (t == list or t == tuple) and t not in connection.encoders:
+        elements = []
+        for e in v:
+            text = _literal_text(connection, e)
+            if text is None:
+                text = u'NULL'
+            elif not ((type(e) == list or type(e) == tuple) and type(e) not in connection.encoders):
+                text = u'"' + text.replace(u'\\', u'\\\\').replace(u'"', u'\\"') + u'"'
+            elements.append(text)
+        return u'{' + u','.join(elements) + u'}'
+    literal = connection.escape_parameter(v)
+    if literal == u'NULL':
+        return None
+    if literal[:1] != u"'":
+        return literal
+    # quoted literal with an optional cast
+    i = 1
+    while True:
+        i = literal.index(u"'", i)
+        if literal[i+1:i+2] != u"'":
+            break
+        i += 2
+    return literal[1:i].replace(u"''", u"'")
+
+
+def _copy_text(connection, v):
+    # a value in COPY text format
+    text = _literal_text(connection, v)
+    if text is None:
+        return u'\\N'
+    return text.replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+
+
+class _CopyRowReader(object):
+    # File-like object reading up to max_rows rows in COPY text format
+    def __init__(self, rows, max_rows, connection):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.connection = connection
+        self.count = 0
+
+    def read(self, size):
+        lines = []
+        n = 0
+        while n < size and self.count < self.max_rows:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                self.max_rows = self.count
+                break
+            line = u'\t'.join([_copy_text(self.connection, v) for v in row]) + u'\n'
+            lines.append(line)
+            n += len(line)
+            self.count += 1
+        return u''.join(lines).encode(self.connection.encoding)
+
+
 class Cursor(object):
     def __init__(self, connection):
         self.connection = connection
         self.description = []
+        self.row_factory = connection.row_factory if connection else None
+        self.query_cache = connection.query_cache if connection else None
+        self.cache_channels = ()
+        self._make_row = tuple
+        self._lazy = False
+        self.streaming = False
+        self._pending = False
+        self.column_sinks = {}
+        self._sinks = {}
+        self._sink_error = None
+        self._copy_source = None
+        self._results = None
+        self._nextsets = []
         self._rows = []
         self._rowcount = 0
         self.arraysize = 1
@@ -288,8 +660,11 @@ class Cursor(object):
     def callproc(self, procname, args=()):
         raise NotSupportedError()
 
-    def nextset(self, procname, args=()):
-        raise NotSupportedError()
+    def nextset(self):
+        if not self._nextsets:
+            return None
+        self.description, self._rows, self._rowcount = self._nextsets.pop(0)
+        return True
 
     def setinputsizes(sizes):
         pass
@@ -300,8 +675,12 @@ class Cursor(object):
     def execute(self, query, args=()):
         if not self.connection or not self.connection.is_connect():
             raise ProgrammingError(u"08003:Lost connection")
+        if self._pending:
+            self.connection._finish_streaming()
         self.description = []
-        self._rows.clear()
+        self._rows = []
+        self._results = None if self.streaming else []
+        self._nextsets = []
         self.args = args
         if args:
             escaped_args = tuple(
@@ -311,8 +690,120 @@ class Cursor(object):
             query = query % escaped_args
             query = query.replace(u'%%', u'%')
         self.query = query
+        if (
+            self.query_cache is not None and self.connection.autocommit and
+            not self.streaming and not self.column_sinks and _is_read_query(query)
+        ):
+            # only committed results out of a transaction are cached
+            key = (self.connection._cache_source, query.strip(), self.row_factory)
+            r = self.query_cache.get(key)
+            if r is not None:
+                self.description, rows, self._rowcount = r
+                self._rows = _copy_rows(rows)
+                return
+            self.connection.execute(query, self)
+            if not self._nextsets:
+                self.query_cache.put(key, self.description, self._rows, self._rowcount, self.cache_channels)
+            return
         self.connection.execute(query, self)
 
+    def execute_values(self, query, rows, template=None, page_size=100):
+        # Expand the '%s' after VALUES into the rows, page_size rows per statement
+        i = query.find(u'%')
+        while i >= 0 and query[i + 1:i + 2] != u's':
+            i = query.find(u'%', i + 2 if query[i + 1:i + 2] == u'%' else i + 1)
+        if i < 0:
+            raise ProgrammingError(u"No '%s' placeholder in the query")
+        pre = query[:i].replace(u'%%', u'%')
+        post = query[i + 2:].replace(u'%%', u'%')
+        escape = self.connection.escape_parameter
+        if self._pending:
+            self.connection._finish_streaming()
+        self.description = []
+        self._nextsets = []
+        results = []
+        rowcount = 0
+        page = []
+        it = iter(rows)
+        while True:
+            try:
+                row = next(it)
+            except StopIteration:
+                end = True
+            else:
+                end = False
+                escaped = tuple(escape(v) for v in row)
+                if template:
+                    page.append(template % escaped)
+                else:
+                    page.append(u'(' + u','.join(escaped) + u')')
+            if page and (end or len(page) == page_size):
+                self.execute(pre + u','.join(page) + post)
+                # fetchall() also reads the rest of a streamed result
+                results.extend(self.fetchall())
+                rowcount += self._rowcount
+                page = []
+            if end:
+                break
+        self._rows = results
+        self._rowcount = rowcount
+
+    def copy_from_file(self, f, table, format='text', columns=None):
+        # f is a path, a file object or a file descriptor
+        close = not hasattr(f, 'read')
+        if isinstance(f, int):
+            try:
+                f = open(f, 'rb', closefd=False)
+            except TypeError:
+                # MicroPython has no closefd, leave the file object open
+                f = open(f, 'rb')
+                close = False
+        elif close:
+            f = open(f, 'rb')
+        query = "COPY {}{} FROM STDIN WITH (FORMAT {})".format(
+            table, ' (' + ', '.join(columns) + ')' if columns else '', format
+        )
+        self._copy_source = f
+        try:
+            self.execute(query)
+        finally:
+            self._copy_source = None
+            if close:
+                f.close()
+
+    def bulk_upsert(self, table, columns, rows, conflict_keys, update_columns=None, chunk_size=100000):
+        # COPY rows into a temporary table by chunk_size rows and merge them
+        # with INSERT ... ON CONFLICT, the last row wins for duplicated keys.
+        tmp = 'micropg_upsert'
+        cols = ', '.join(columns)
+        keys = ', '.join(conflict_keys)
+        if update_columns is None:
+            update_columns = [c for c in columns if c not in conflict_keys]
+        if update_columns:
+            action = 'DO UPDATE SET ' + ', '.join(['{0} = EXCLUDED.{0}'.format(c) for c in update_columns])
+        else:
+            action = 'DO NOTHING'
+        # created by each call for its columns, a session table works also with autocommit
+        self.execute('DROP TABLE IF EXISTS ' + tmp)
+        self.execute('CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WITH NO DATA'.format(tmp, cols, table))
+        it = iter(rows)
+        rowcount = 0
+        while True:
+            reader = _CopyRowReader(it, chunk_size, self.connection)
+            self.execute('TRUNCATE ' + tmp)
+            self.connection.execute('COPY {} ({}) FROM STDIN'.format(tmp, cols), reader)
+            if reader.count:
+                self.execute(
+                    'INSERT INTO {0} ({1}) SELECT DISTINCT ON ({2}) {1} FROM {3} '
+                    'ORDER BY {2}, ctid DESC ON CONFLICT ({2}) {4}'.format(table, cols, keys, tmp, action)
+                )
+                rowcount += self._rowcount
+            if reader.count < chunk_size:
+                break
+        self.execute('DROP TABLE ' + tmp)
+        self._rowcount = rowcount
+        return rowcount
+
     def executemany(self, query, seq_of_params):
         rowcount = 0
         for params in seq_of_params:
@@ -323,6 +814,11 @@ class Cursor(object):
     def fetchone(self):
         if not self.connection or not self.connection.is_connect():
             raise OperationalError(u"08003:Lost connection")
+        if not len(self._rows) and self._pending:
+            # receive the next row
+            self.connection.process_messages(self)
+            if not self._pending and self.connection.autocommit:
+                self.connection._commit()
         if len(self._rows):
             r = self._rows[0]
             self._rows = self._rows[1:]
@@ -339,6 +835,8 @@ class Cursor(object):
         return rs
 
     def fetchall(self):
+        if self._pending:
+            self.connection._finish_streaming(True)
         r = list(self._rows)
         self._rows.clear()
         return r
@@ -367,8 +865,252 @@ class Cursor(object):
         return self.__next__()
 
 
+def _lsn_to_str(lsn):
+    return '%X/%X' % (lsn >> 32, lsn & 0xffffffff)
+
+
+def _str_to_lsn(s):
+    hi, lo = s.split('/')
+    return (int(hi, 16) << 32) + int(lo, 16)
+
+
+def _pg_timestamp(t):
+    # microseconds since 2000-01-01
+    return max(int((t - 946684800) * 1000000), 0)
+
+
+class ReplicationMessage(object):
+    def __init__(self, kind, data_start, **kwargs):
+        self.kind = kind
+        self.data_start = data_start
+        for k in kwargs:
+            setattr(self, k, kwargs[k])
+
+    def __repr__(self):
+        return 'ReplicationMessage(' + ', '.join(['%s=%r' % (k, v) for k, v in self.__dict__.items()]) + ')'
+
+
+class ReplicationStream(object):
+    # pgoutput logical replication messages received over CopyBoth.
+    def __init__(self, connection, start_lsn, status_interval):
+        self.connection = connection
+        self.status_interval = status_interval
+        self.received_lsn = start_lsn
+        self.flush_lsn = start_lsn
+        self.relations = {}
+        self._next_status = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        import time
+        while True:
+            if not self.connection:
+                raise StopIteration()
+            now = time.time()
+            if now >= self._next_status:
+                self.send_feedback()
+                now = time.time()
+            if not self.connection._wait_readable(self._next_status - now):
+                continue
+            code, data = self.connection._process_async_message()
+            if code == 100:     # CopyData('d')
+                if data[:1] == b'w':    # XLogData
+                    data_start = _bytes_to_bint(data[1:9])
+                    wal_end = _bytes_to_bint(data[9:17])
+                    if wal_end > self.received_lsn:
+                        self.received_lsn = wal_end
+                    return self._decode(data_start, data[25:])
+                elif data[:1] == b'k':  # Primary keepalive
+                    wal_end = _bytes_to_bint(data[1:9])
+                    if wal_end > self.received_lsn:
+                        self.received_lsn = wal_end
+                    if data[17:18] == b'\x01':
+                        self.send_feedback()
+            elif code == 99:    # CopyDone('c')
+                self.close()
+
+    def next(self):
+        return self.__next__()
+
+    def _read_tuple(self, data, n, relation):
+        values = {}
+        count = _bytes_to_bint(data[n:n+2])
+        n += 2
+        for i in range(count):
+            name, type_oid = relation[2][i]
+            kind = data[n:n+1]
+            n += 1
+            if kind == b'n':
+                values[name] = None
+            elif kind in (b't', b'b'):
+                ln = _bytes_to_bint(data[n:n+4])
+                n += 4
+                if kind == b't':
+                    values[name] = _decode_column(data[n:n+ln], type_oid, self.connection.encoding)
+                else:
+                    values[name] = data[n:n+ln]
+                n += ln
+            # 'u' unchanged TOASTed value is omitted
+        return values, n
+
+    def _decode(self, data_start, data):
+        encoding = self.connection.encoding
+        kind = bytes(data[:1])
+        if kind == b'B':
+            return ReplicationMessage(
+                'begin', data_start, final_lsn=_bytes_to_bint(data[1:9]),
+                commit_time=_bytes_to_bint(data[9:17]), xid=_bytes_to_bint(data[17:21])
+            )
+        elif kind == b'C':
+            return ReplicationMessage(
+                'commit', data_start, commit_lsn=_bytes_to_bint(data[2:10]),
+                end_lsn=_bytes_to_bint(data[10:18]), commit_time=_bytes_to_bint(data[18:26])
+            )
+        elif kind == b'R':
+            relid = _bytes_to_bint(data[1:5])
+            n = 5
+            namespace = data[n:n+data[n:].find(b'\x00')]
+            n += len(namespace) + 1
+            name = data[n:n+data[n:].find(b'\x00')]
+            n += len(name) + 2      # with replica identity setting
+            count = _bytes_to_bint(data[n:n+2])
+            n += 2
+            columns = []
+            for i in range(count):
+                n += 1              # flags
+                column = data[n:n+data[n:].find(b'\x00')]
+                n += len(column) + 1
+                columns.append((column.decode(encoding), _bytes_to_bint(data[n:n+4])))
+                n += 8              # type oid and modifier
+            relation = (namespace.decode(encoding), name.decode(encoding), columns)
+            self.relations[relid] = relation
+            return ReplicationMessage('relation', data_start, relation=relation)
+        elif kind in (b'I', b'U', b'D'):
+            relation = self.relations[_bytes_to_bint(data[1:5])]
+            n = 5
+            old = new = None
+            if data[n:n+1] in (b'K', b'O'):
+                old, n = self._read_tuple(data, n+1, relation)
+            if data[n:n+1] == b'N':
+                new, n = self._read_tuple(data, n+1, relation)
+            return ReplicationMessage(
+                {b'I': 'insert', b'U': 'update', b'D': 'delete'}[kind], data_start,
+                relation=relation, old=old, new=new
+            )
+        return ReplicationMessage('other', data_start, data=data)
+
+    def send_feedback(self, flush_lsn=None, reply=False):
+        import time
+        if flush_lsn is not None:
+            self.flush_lsn = flush_lsn
+        now = time.time()
+        self.connection._send_data(b'd', b''.join([
+            b'r',
+            self.received_lsn.to_bytes(8, 'big'),
+            self.flush_lsn.to_bytes(8, 'big'),
+            self.flush_lsn.to_bytes(8, 'big'),
+            _pg_timestamp(now).to_bytes(8, 'big'),
+            b'\x01' if reply else b'\x00',
+        ]))
+        self._next_status = now + self.status_interval
+
+    def close(self):
+        conn = self.connection
+        if not conn:
+            return
+        self.connection = None
+        if not conn.sock:
+            return
+        conn._write(b'c\x00\x00\x00\x04')     # CopyDone
+        while True:
+            code, data = conn._read_message()
+            if code == 90:
+                conn._ready_for_query = data
+                break
+
+
+class LObject(object):
+    # File-like large object accessed by fastpath function calls.
+    chunk_size = 65536
+
+    def __init__(self, connection, oid, fd):
+        self.connection = connection
+        self.oid = oid
+        self.fd = fd
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def _call(self, name, *args):
+        return self.connection._lo_call(name, (_bint_to_bytes(self.fd), ) + args)
+
+    def readinto(self, b):
+        m = memoryview(b)
+        n = 0
+        while n < len(m):
+            data = self._call('loread', _bint_to_bytes(min(len(m) - n, self.chunk_size)))
+            m[n:n+len(data)] = data
+            n += len(data)
+            if not data:
+                break
+        return n
+
+    def read(self, size=-1):
+        r = []
+        while size:
+            data = self._call('loread', _bint_to_bytes(self.chunk_size if size < 0 else min(size, self.chunk_size)))
+            if not data:
+                break
+            r.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(r)
+
+    def write(self, b):
+        m = memoryview(b)
+        n = 0
+        while n < len(m):
+            n += _bytes_to_bint(self._call('lowrite', m[n:n+self.chunk_size]))
+        return n
+
+    def seek(self, offset, whence=0):
+        return _bytes_to_bint(self._call(
+            'lo_lseek64', (offset & 0xffffffffffffffff).to_bytes(8, 'big'), _bint_to_bytes(whence)
+        ))
+
+    def tell(self):
+        return _bytes_to_bint(self._call('lo_tell64'))
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.tell()
+        self._call('lo_truncate64', size.to_bytes(8, 'big'))
+        return size
+
+    def close(self):
+        if self.fd is not None and self.connection.is_connect():
+            self._call('lo_close')
+        self.fd = None
+
+
 class Connection(object):
-    def __init__(self, user, password, database, host, port, timeout, use_ssl):
+    connect_stagger = 0.25
+    recv_buffer_size = 1024
+    stream_chunk_size = 8192
+    max_field_size = None
+
+    def __init__(self, user, password, database, host, port, timeout, use_ssl, target_session_attrs='any', sslnegotiation='postgres', replication=None, parameters=None, options=None):
         self.user = user
         self.password = password
         self.database = database
@@ -376,13 +1118,29 @@ class Connection(object):
         self.port = port
         self.timeout = timeout
         self.use_ssl = use_ssl
+        self.sslnegotiation = sslnegotiation
+        self.replication = replication
+        self.parameters = dict(parameters) if parameters else {}
+        if options:
+            self.parameters['options'] = options
+        self.target_session_attrs = target_session_attrs
         self.encoding = 'UTF8'
         self.autocommit = False
         self.server_version = ''
         self._ready_for_query = b'I'
         self.encoders = {}
+        self.row_factory = None
+        self.query_cache = None
+        self._cache_source = (host, port, database, user)
+        self._written_caches = []
         self.tz_name = None
         self.tzinfo = None
+        self._notifies = []
+        self._parameter_status = {}
+        self._lo_functions = {}
+        self._streaming = None
+        self._recv_buf = bytearray(self.recv_buffer_size)
+        self._recv_view = memoryview(self._recv_buf)
         self._open()
 
     def __enter__(self):
@@ -395,8 +1153,82 @@ class Connection(object):
         self._write(b''.join([message, _bint_to_bytes(len(data) + 4), data]))
 
     def _send_message(self, message, data):
+        self._finish_streaming()
         self._write(b''.join([message, _bint_to_bytes(len(data) + 4), data, b'H\x00\x00\x00\x04']))
 
+    def _parse_error(self, data):
+        err = data.split(b'\x00')
+        # http://www.postgresql.org/docs/9.3/static/errcodes-appendix.html
+        errcode = err[2][1:]
+        message = errcode + b':' + err[3][1:]
+        message = message.decode(self.encoding)
+        if errcode[:2] == b'0A':
+            return NotSupportedError(message, errcode)
+        elif errcode[:2] in (b'20', b'21'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:2] in (b'22', ):
+            return DataError(message, errcode)
+        elif errcode[:2] == b'23':
+            return IntegrityError(message, errcode)
+        elif errcode[:2] in(b'24', b'25'):
+            return InternalError(message, errcode)
+        elif errcode[:2] in(b'26', b'27', b'28'):
+            return OperationalError(message, errcode)
+        elif errcode[:2] in(b'2B', b'2D', b'2F'):
+            return InternalError(message, errcode)
+        elif errcode[:2] == b'34':
+            return OperationalError(message, errcode)
+        elif errcode[:2] in (b'38', b'39', b'3B'):
+            return InternalError(message, errcode)
+        elif errcode[:2] in (b'3D', b'3F'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:2] in (b'40', b'42', b'44'):
+            return ProgrammingError(message, errcode)
+        elif errcode[:1] == b'5':
+            return OperationalError(message, errcode)
+        elif errcode[:1] in b'F':
+            return InternalError(message, errcode)
+        elif errcode[:1] in b'H':
+            return OperationalError(message, errcode)
+        elif errcode[:1] in (b'P', b'X'):
+            return InternalError(message, errcode)
+        else:
+            return DatabaseError(message, errcode)
+
+    def _process_parameter_status(self, data):
+        k, v, _ = data.split(b'\x00')
+        # values such as application_name may be any text given at startup
+        self._parameter_status[k.decode('ascii')] = v.decode(self.encoding)
+        if k == b'server_encoding':
+            self.encoding = v.decode('ascii')
+        elif k == b'server_version':
+            version = v.decode('ascii').split('(')[0].split('.')
+            self.server_version = int(version[0]) * 10000
+            if len(version) > 0:
+                try:
+                    self.server_version += int(version[1]) * 100
+                except Exception:
+                    pass
+            if len(version) > 1:
+                try:
+                    self.server_version += int(version[2])
+                except Exception:
+                    pass
+        elif k == b'TimeZone':
+            self.tz_name = v.decode(self.encoding)
+            self.tzinfo = None
+
+    def _parse_notification(self, data):
+        pid = _bytes_to_bint(data[:4])
+        channel, payload, _ = data[4:].split(b'\x00')
+        return (pid, channel.decode(self.encoding), payload.decode(self.encoding))
+
+    def _notified(self, data):
+        notify = self._parse_notification(data)
+        self._notifies.append(notify)
+        if self.query_cache is not None:
+            self.query_cache.invalidate(notify[1])
+
     def _process_messages(self, obj):
         errobj = None
         while True:
@@ -406,9 +1238,32 @@ class Connection(object):
                 # something error occured
                 break
             ln = _bytes_to_bint(self._read(4)) - 4
-            data = self._read(ln)
+            if code == 68 and obj is None:
+                self._skip(ln)
+                continue
+            elif code == 68 and isinstance(obj, Cursor) and obj._sinks:
+                data = self._read_sink_row(obj)
+                if obj._sink_error is not None:
+                    if not errobj:
+                        errobj = obj._sink_error
+                    obj._sink_error = None
+            elif code == 68 and self.max_field_size is not None and ln > self.max_field_size:
+                data = self._read_capped_row(ln)
+                if data is None:
+                    if not errobj:
+                        errobj = DataError(u"54000:Field size exceeds max_field_size", b'54000')
+                    continue
+            else:
+                data = self._read(ln)
             if code == 90:
                 self._ready_for_query = data
+                if isinstance(obj, Cursor) and obj._results:
+                    obj.description, obj._rows, obj._rowcount = obj._results[0]
+                    obj._nextsets = obj._results[1:]
+                    obj._results = None
+                if self._streaming is not None:
+                    self._streaming._pending = False
+                    self._streaming = None
                 break
             elif code == 82:
                 auth_method = _bytes_to_bint(data[:4])
@@ -479,7 +1334,7 @@ class Connection(object):
                     )
 
                     proof = binascii.b2a_base64(
-                        b"".join([bytes([x ^ y]) for x, y in zip(client_key, client_sig)])
+                        bytes([x ^ y for x, y in zip(client_key, client_sig)])
                     )
                     if proof[-1:] == b'\n':
                         proof = proof[:-1]
@@ -505,40 +1360,28 @@ class Connection(object):
                 else:
                     errobj = InterfaceError("Authentication method %d not supported." % (auth_method,))
             elif code == 83:
-                k, v, _ = data.split(b'\x00')
-                if k == b'server_encoding':
-                    self.encoding = v.decode('ascii')
-                elif k == b'server_version':
-                    version = v.decode('ascii').split('(')[0].split('.')
-                    self.server_version = int(version[0]) * 10000
-                    if len(version) > 0:
-                        try:
-                            self.server_version += int(version[1]) * 100
-                        except Exception:
-                            pass
-                    if len(version) > 1:
-                        try:
-                            self.server_version += int(version[2])
-                        except Exception:
-                            pass
-                elif k == b'TimeZone':
-                    self.tz_name = v.decode('ascii')
-                    self.tzinfo = None
+                self._process_parameter_status(data)
             elif code == 75:
                 pass
             elif code == 67:
-                if not obj:
+                if not isinstance(obj, Cursor):
                     continue
                 command = data[:-1].decode('ascii')
                 if command == 'SHOW':
                     obj._rowcount = 1
                 else:
-                    for k in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+                    for k in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'COPY'):
                         if command[:len(k)] == k:
                             obj._rowcount = int(command.split(' ')[-1])
                             break
+                if obj._results is not None:
+                    # a result set of a statement in the query
+                    obj._results.append((obj.description, obj._rows, obj._rowcount))
+                    obj.description = []
+                    obj._rows = []
+                    obj._rowcount = -1
             elif code == 84:
-                if not obj:
+                if not isinstance(obj, Cursor):
                     continue
                 count = _bytes_to_bint(data[0:2])
                 obj.description = [None] * count
@@ -574,63 +1417,50 @@ class Connection(object):
                     n += 18
                     obj.description[idx] = field
                     idx += 1
+                obj._sinks = {}
+                names = [d[0] for d in obj.description]
+                for k in obj.column_sinks:
+                    # columns not in this result are ignored
+                    if isinstance(k, int):
+                        obj._sinks[k] = obj.column_sinks[k]
+                    elif k in names:
+                        obj._sinks[names.index(k)] = obj.column_sinks[k]
+                obj._sink_rows = 0
+                row_factory = obj.row_factory
+                if row_factory is lazy_row and obj._sinks:
+                    row_factory = compact_row
+                obj._make_row = row_factory(obj) if row_factory else tuple
+                obj._lazy = row_factory is lazy_row
             elif code == 68:
-                if not obj:
+                if not isinstance(obj, Cursor):
                     continue
-                n = 2
-                row = []
-                while n < len(data):
-                    if data[n:n+4] == b'\xff\xff\xff\xff':
-                        row.append(None)
-                        n += 4
-                    else:
-                        ln = _bytes_to_bint(data[n:n+4])
-                        n += 4
-                        row.append(data[n:n+ln])
-                        n += ln
-                for i in range(len(row)):
-                    row[i] = _decode_column(row[i], obj.description[i][1], self.encoding)
-                obj._rows.append(tuple(row))
+                if obj._sinks or obj._lazy:
+                    row = data
+                else:
+                    n = 2
+                    row = []
+                    while n < len(data):
+                        if data[n:n+4] == b'\xff\xff\xff\xff':
+                            row.append(None)
+                            n += 4
+                        else:
+                            ln = _bytes_to_bint(data[n:n+4])
+                            n += 4
+                            row.append(data[n:n+ln])
+                            n += ln
+                    for i in range(len(row)):
+                        row[i] = _decode_column(row[i], obj.description[i][1], self.encoding)
+                obj._rows.append(obj._make_row(row))
+                if obj.streaming:
+                    obj._pending = True
+                    self._streaming = obj
+                    break
             elif code == 78:
                 pass
+            elif code == 65:    # NotificationResponse('A')
+                self._notified(data)
             elif code == 69 and not errobj:
-                err = data.split(b'\x00')
-                # http://www.postgresql.org/docs/9.3/static/errcodes-appendix.html
-                errcode = err[2][1:]
-                message = errcode + b':' + err[3][1:]
-                message = message.decode(self.encoding)
-                if errcode[:2] == b'0A':
-                    errobj = NotSupportedError(message, errcode)
-                elif errcode[:2] in (b'20', b'21'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:2] in (b'22', ):
-                    errobj = DataError(message, errcode)
-                elif errcode[:2] == b'23':
-                    errobj = IntegrityError(message, errcode)
-                elif errcode[:2] in(b'24', b'25'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] in(b'26', b'27', b'28'):
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:2] in(b'2B', b'2D', b'2F'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] == b'34':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:2] in (b'38', b'39', b'3B'):
-                    errobj = InternalError(message, errcode)
-                elif errcode[:2] in (b'3D', b'3F'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:2] in (b'40', b'42', b'44'):
-                    errobj = ProgrammingError(message, errcode)
-                elif errcode[:1] == b'5':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:1] in b'F':
-                    errobj = InternalError(message, errcode)
-                elif errcode[:1] in b'H':
-                    errobj = OperationalError(message, errcode)
-                elif errcode[:1] in (b'P', b'X'):
-                    errobj = InternalError(message, errcode)
-                else:
-                    errobj = DatabaseError(message, errcode)
+                errobj = self._parse_error(data)
             elif code == 72:    # CopyOutputResponse('H')
                 pass
             elif code == 100:   # CopyData('d')
@@ -638,15 +1468,33 @@ class Connection(object):
             elif code == 99:    # CopyDataDone('c')
                 pass
             elif code == 71:    # CopyInResponse('G')
-                while True:
-                    buf = obj.read(8192)
-                    if not buf:
-                        break
-                    # send CopyData
-                    self._write(b'd' + _bint_to_bytes(len(buf) + 4))
-                    self._write(buf)
-                # send CopyDone and Sync
-                self._write(b'c\x00\x00\x00\x04S\x00\x00\x00\x04')
+                try:
+                    if isinstance(obj, Cursor):
+                        if obj._copy_source is not None:
+                            self._copy_in_file(obj._copy_source)
+                    else:
+                        while True:
+                            buf = obj.read(8192)
+                            if not buf:
+                                break
+                            # send CopyData
+                            self._write(b'd' + _bint_to_bytes(len(buf) + 4))
+                            self._write(buf)
+                except OperationalError:
+                    raise
+                except Exception as e:
+                    # send CopyFail and raise the error after ReadyForQuery
+                    message = str(e).encode(self.encoding) + b'\x00'
+                    self._write(b'f' + _bint_to_bytes(len(message) + 4) + message)
+                    if not errobj:
+                        errobj = e
+                else:
+                    # send CopyDone, a Sync would get another ReadyForQuery in simple query
+                    self._write(b'c\x00\x00\x00\x04')
+            elif code == 86:    # FunctionCallResponse('V')
+                obj.append(None if data[:4] == b'\xff\xff\xff\xff' else data[4:])
+            elif code == 87:    # CopyBothResponse('W')
+                break
             else:
                 pass
         return errobj
@@ -656,19 +1504,175 @@ class Connection(object):
         if err:
             raise err
 
-    def _read(self, ln):
+    def _recv_into(self, m):
         if not self.sock:
             raise OperationalError(u"08003:Lost connection")
-        r = b''
-        while len(r) < ln:
-            if hasattr(self.sock, "read"):
-                b = self.sock.read(ln-len(r))
+        n = 0
+        while n < len(m):
+            if hasattr(self.sock, "readinto"):
+                b = self.sock.readinto(m[n:])
             else:
-                b = self.sock.recv(ln-len(r))
+                b = self.sock.recv_into(m[n:])
             if not b:
                 raise OperationalError(u"08003:Can't recv packets")
-            r += b
-        return r
+            n += b
+
+    def _read(self, ln):
+        # Small messages are received in the reused buffer,
+        # the others into a bytearray of their size, both returned as bytes
+        # which MicroPython's bytes.join() requires.
+        if ln <= len(self._recv_buf):
+            m = self._recv_view[:ln]
+            self._recv_into(m)
+            return bytes(m)
+        r = bytearray(ln)
+        self._recv_into(memoryview(r))
+        return bytes(r)
+
+    def _read_capped_row(self, ln):
+        # Read a DataRow field by field, None if a field exceeds max_field_size
+        parts = [self._read(2)]
+        n = 2
+        for i in range(_bytes_to_bint(parts[0])):
+            b = self._read(4)
+            n += 4
+            parts.append(b)
+            if b == b'\xff\xff\xff\xff':
+                continue
+            field_ln = _bytes_to_bint(b)
+            if field_ln > self.max_field_size:
+                self._skip(ln - n)
+                return None
+            parts.append(self._read(field_ln))
+            n += field_ln
+        return b''.join(parts)
+
+    def _read_sink_row(self, obj):
+        # Read a DataRow writing the columns in column_sinks to the sinks
+        row = []
+        for i in range(_bytes_to_bint(self._read(2))):
+            b = self._read(4)
+            if b == b'\xff\xff\xff\xff':
+                row.append(None)
+                continue
+            field_ln = _bytes_to_bint(b)
+            sink = obj._sinks.get(i)
+            if sink is None:
+                row.append(_decode_column(self._read(field_ln), obj.description[i][1], self.encoding))
+                continue
+            if not hasattr(sink, 'write'):
+                try:
+                    sink = sink(obj._sink_rows)
+                except Exception as e:
+                    obj._sink_error = obj._sink_error or e
+                    sink = None
+            row.append(self._copy_field(field_ln, sink, obj.description[i][1] == PG_TYPE_BYTEA, obj))
+        obj._sink_rows += 1
+        return row
+
+    def _copy_field(self, ln, sink, is_bytea, obj):
+        # Write a field to the sink by chunks, hex bytea are decoded on the fly.
+        # After an error of the sink the rest is read without writing,
+        # the error is kept in the cursor and raised after ReadyForQuery.
+        written = 0
+        if is_bytea:
+            assert self._read(2) == b'\\x'
+            ln -= 2
+        buf = memoryview(bytearray(min(ln, self.stream_chunk_size)))
+        carry = b''
+        while ln > 0:
+            m = buf[:min(ln, len(buf))]
+            self._recv_into(m)
+            ln -= len(m)
+            if is_bytea:
+                chunk = carry + bytes(m)
+                even = len(chunk) & ~1
+                carry = chunk[even:]
+                m = binascii.unhexlify(chunk[:even])
+            if sink is not None:
+                try:
+                    sink.write(m)
+                except Exception as e:
+                    obj._sink_error = obj._sink_error or e
+                    sink = None
+            written += len(m)
+        return written
+
+    def _copy_in_file(self, f):
+        # Send a file as CopyData messages, with sendfile() or mmap if possible
+        frame_size = 64 * 1024 * 1024
+        try:
+            import os
+            offset = f.tell()
+            size = os.fstat(f.fileno())[6] - offset
+        except (AttributeError, OSError):
+            size = None
+        if size and hasattr(self.sock, 'sendfile') and not hasattr(self.sock, 'cipher'):
+            while size > 0:
+                n = min(size, frame_size)
+                self._write(b'd' + _bint_to_bytes(n + 4))
+                sent = 0
+                while sent < n:
+                    r = self.sock.sendfile(f, offset + sent, n - sent)
+                    if not r:
+                        # the file got shorter, complete the message and fail the COPY
+                        zeros = bytes(min(n - sent, 8192))
+                        while sent < n:
+                            self._write(zeros[:n - sent])
+                            sent += len(zeros)
+                        raise InterfaceError("The file got shorter while sending it")
+                    sent += r
+                offset += n
+                size -= n
+            return
+        if size:
+            try:
+                import mmap
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ImportError, OSError):
+                m = None
+            if m is not None:
+                size = min(size, len(m) - offset)
+                view = memoryview(m)
+                while size > 0:
+                    n = min(size, frame_size)
+                    self._write(b'd' + _bint_to_bytes(n + 4))
+                    self._write(view[offset:offset+n])
+                    offset += n
+                    size -= n
+                view.release()
+                m.close()
+                return
+        buf = bytearray(self.stream_chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            self._write(b'd' + _bint_to_bytes(n + 4))
+            self._write(view[:n])
+
+    def _finish_streaming(self, keep=False):
+        # Receive the rest of the streamed rows, discarded one by one unless keep
+        cur = self._streaming
+        if cur is not None:
+            if keep:
+                cur.streaming = False
+                try:
+                    self.process_messages(cur)
+                finally:
+                    cur.streaming = True
+            else:
+                cur._rows = []
+                self.process_messages(None)
+            if self.autocommit:
+                self._commit()
+
+    def _skip(self, ln):
+        while ln > 0:
+            n = min(ln, len(self._recv_buf))
+            self._recv_into(self._recv_view[:n])
+            ln -= n
 
     def _write(self, b):
         if not self.sock:
@@ -680,31 +1684,257 @@ class Connection(object):
             else:
                 n += self.sock.send(b[n:])
 
-    def _open(self):
-        self.sock = socket.socket()
-        self.sock.connect(socket.getaddrinfo(self.host, self.port)[0][-1])
+    def _wait_readable(self, timeout):
+        if hasattr(self.sock, "pending") and self.sock.pending():
+            return True
+        import select
+        if timeout is None:
+            r, _, _ = select.select([self.sock], [], [])
+        else:
+            r, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        return bool(r)
+
+    def _read_message(self):
+        code = ord(self._read(1))
+        ln = _bytes_to_bint(self._read(4)) - 4
+        return code, self._read(ln)
+
+    def _process_async_message(self):
+        code, data = self._read_message()
+        if code == 65:      # NotificationResponse('A')
+            self._notified(data)
+        elif code == 83:    # ParameterStatus('S')
+            self._process_parameter_status(data)
+        elif code == 69:    # ErrorResponse('E') e.g. server shutdown
+            err = self._parse_error(data)
+            self.sock.close()
+            self.sock = None
+            raise err
+        return code, data
+
+    def notifies(self):
+        r = self._notifies
+        self._notifies = []
+        return r
 
+    def wait_notify(self, timeout=None):
+        if not self.sock:
+            raise OperationalError(u"08003:Lost connection")
+        if not self._notifies:
+            import time
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while not self._notifies:
+                if timeout is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                if self._wait_readable(timeout):
+                    self._process_async_message()
+        if self._notifies:
+            return self._notifies.pop(0)
+        return None
+
+    def _addresses(self):
+        hosts = self.host
+        if isinstance(hosts, str):
+            hosts = hosts.split(',')
+        addrs = []
+        for host in hosts:
+            host = host.strip()
+            port = self.port
+            if host.count(':') == 1:
+                host, port = host.split(':')
+                port = int(port)
+            try:
+                for ai in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+                    addrs.append((ai[0], ai[-1], host))
+            except OSError:
+                pass
+        if not addrs:
+            raise OperationalError(u"08001:Can't resolve host %s" % (self.host, ))
+        return addrs
+
+    def _connect_socket(self, addrs):
+        if len(addrs) == 1:
+            sock = socket.socket(addrs[0][0], socket.SOCK_STREAM)
+            sock.connect(addrs[0][1])
+            return sock, addrs[0]
+
+        # Start a connection attempt every connect_stagger seconds until one
+        # of them completes, the first one connected wins.
+        import errno
+        import select
+        import time
+        if self.timeout is not None:
+            deadline = time.time() + float(self.timeout)
+        rest = list(addrs)
+        pending = {}
+        winner = None
+        while winner is None and (rest or pending):
+            if rest:
+                addr = rest.pop(0)
+                sock = socket.socket(addr[0], socket.SOCK_STREAM)
+                sock.setblocking(False)
+                try:
+                    sock.connect(addr[1])
+                except OSError as e:
+                    if e.args[0] not in (errno.EINPROGRESS, errno.EAGAIN):
+                        sock.close()
+                        continue
+                pending[sock] = addr
+            wait = self.connect_stagger if rest else None
+            if self.timeout is not None:
+                remain = deadline - time.time()
+                if remain <= 0:
+                    break
+                wait = remain if wait is None else min(wait, remain)
+            socks = list(pending)
+            if wait is None:
+                _, w, x = select.select([], socks, socks)
+            else:
+                _, w, x = select.select([], socks, socks, wait)
+            for sock in socks:
+                if sock not in w and sock not in x:
+                    continue
+                addr = pending.pop(sock)
+                try:
+                    # connect again to know the result of the attempt
+                    sock.connect(addr[1])
+                    connected = True
+                except OSError as e:
+                    # errno of MicroPython may lack EISCONN
+                    connected = e.args[0] == getattr(errno, 'EISCONN', 106)
+                if winner is None and connected:
+                    winner = (sock, addr)
+                else:
+                    sock.close()
+        for sock in pending:
+            sock.close()
+        if winner is None:
+            raise OperationalError(u"08001:Can't connect to %s" % (self.host, ))
+        winner[0].setblocking(True)
+        return winner
+
+    def _ssl_context(self):
+        import ssl
+        global _default_ssl_context
+        if not isinstance(self.use_ssl, bool):
+            context = self.use_ssl
+        elif _default_ssl_context is None and hasattr(ssl, 'SSLContext'):
+            # no certificate verification, pass an ssl.SSLContext to verify
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            # required by direct SSL negotiation, a given context is not changed
+            if hasattr(context, 'set_alpn_protocols'):
+                context.set_alpn_protocols(['postgresql'])
+            _default_ssl_context = context
+        else:
+            context = _default_ssl_context
+        return context
+
+    def _wrap_ssl(self, addr):
+        context = self._ssl_context()
+        if context is None:
+            import ssl
+            self.sock = ssl.wrap_socket(self.sock)
+            return
+        key = (context, addr[1])
+        session = _ssl_sessions.get(key)
+        if session is not None:
+            self.sock = context.wrap_socket(self.sock, server_hostname=addr[2], session=session)
+        else:
+            self.sock = context.wrap_socket(self.sock, server_hostname=addr[2])
+
+    def _save_ssl_session(self, addr):
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            key = (self._ssl_context(), addr[1])
+            if key not in _ssl_sessions and len(_ssl_sessions) >= _ssl_sessions_max:
+                # evict the oldest one
+                del _ssl_sessions[next(iter(_ssl_sessions))]
+            _ssl_sessions[key] = session
+
+    def _startup(self, addr):
         if self.timeout is not None:
             self.sock.settimeout(float(self.timeout))
 
         if self.use_ssl:
-            self._write(_bint_to_bytes(8))
-            self._write(_bint_to_bytes(80877103))    # SSL request
-            if self._read(1) == b'S':
-                import ssl
-                self.sock = ssl.wrap_socket(self.sock)
-            else:
-                raise InterfaceError("Server refuses SSL")
+            if self.sslnegotiation != 'direct':
+                self._write(_bint_to_bytes(8))
+                self._write(_bint_to_bytes(80877103))    # SSL request
+                if self._read(1) != b'S':
+                    raise InterfaceError("Server refuses SSL")
+            self._wrap_ssl(addr)
 
         # protocol version 3.0
         v = b'\x00\x03\x00\x00'
         v += b'user\x00' + self.user.encode('ascii') + b'\x00'
         if self.database:
             v += b'database\x00' + self.database.encode('ascii') + b'\x00'
+        if self.replication:
+            v += b'replication\x00' + self.replication.encode('ascii') + b'\x00'
+        for k in self.parameters:
+            v += k.encode('ascii') + b'\x00' + str(self.parameters[k]).encode('utf-8') + b'\x00'
         v += b'\x00'
 
         self._write(_bint_to_bytes(len(v) + 4) + v)
         self.process_messages(None)
+        if self.use_ssl:
+            self._save_ssl_session(addr)
+
+    def _match_session_attrs(self, attrs):
+        if attrs == 'any':
+            return True
+        standby = self._parameter_status.get('in_hot_standby')
+        read_only = self._parameter_status.get('default_transaction_read_only')
+        if standby is None or read_only is None:
+            # before PostgreSQL 14 these are not reported by ParameterStatus
+            cur = self._simple_query("SELECT pg_is_in_recovery(), current_setting('transaction_read_only')")
+            standby, read_only = cur.fetchone()
+        else:
+            standby = standby == 'on'
+        read_only = read_only == 'on' or standby
+        if attrs == 'read-write':
+            return not read_only
+        elif attrs == 'read-only':
+            return read_only
+        elif attrs == 'primary':
+            return not standby
+        elif attrs == 'standby':
+            return standby
+
+    def _open(self):
+        if self.target_session_attrs not in (
+            'any', 'read-write', 'read-only', 'primary', 'standby', 'prefer-standby'
+        ):
+            raise InterfaceError("Invalid target_session_attrs '%s'" % (self.target_session_attrs, ))
+        if self.target_session_attrs == 'prefer-standby':
+            passes = ('standby', 'any')
+        else:
+            passes = (self.target_session_attrs, )
+        addrs = self._addresses()
+        err = None
+        for attrs in passes:
+            rest = list(addrs)
+            while rest:
+                self._parameter_status = {}
+                try:
+                    self.sock, addr = self._connect_socket(rest)
+                except (OSError, OperationalError) as e:
+                    err = e
+                    break
+                rest.remove(addr)
+                try:
+                    self._startup(addr)
+                    if self._match_session_attrs(attrs):
+                        return
+                    err = OperationalError(u"08001:Server does not match target_session_attrs '%s'" % (attrs, ))
+                except (OSError, Error) as e:
+                    err = e
+                self.close()
+        raise err
 
     def escape_parameter(self, v):
         t = type(v)
@@ -735,10 +1965,15 @@ class Connection(object):
         return Cursor(self)
 
     def _execute(self, query, obj):
+        if not _is_read_query(query):
+            # the cached results are invalidated when the writes are committed
+            for cache in (self.query_cache, getattr(obj, 'query_cache', None)):
+                if cache is not None and cache not in self._written_caches:
+                    self._written_caches.append(cache)
         self._send_message(b'Q', query.encode(self.encoding) + b'\x00')
         self.process_messages(obj)
-        if self.autocommit:
-            self.commit()
+        if self.autocommit and self._streaming is None:
+            self._commit()
 
     def execute(self, query, obj=None):
         if self._ready_for_query != b'T':
@@ -747,7 +1982,17 @@ class Connection(object):
 
     @property
     def isolation_level(self):
-        return self.get_parameter_status('TRANSACTION ISOLATION LEVEL')
+        return self.get_parameter_status('transaction_isolation')
+
+    @property
+    def parameter_status(self):
+        return dict(self._parameter_status)
+
+    def get_parameter_status(self, name):
+        # reported by the server with ParameterStatus, otherwise SHOW
+        if name in self._parameter_status:
+            return self._parameter_status[name]
+        return self._simple_query('SHOW ' + name).fetchone()[0]
 
     def set_autocommit(self, autocommit):
         self.autocommit = autocommit
@@ -761,21 +2006,110 @@ class Connection(object):
             self._rollback()
         self._begin()
 
-    def commit(self):
+    def _commit(self):
         if self.sock:
             self._send_message(b'Q', b"COMMIT\x00")
             self.process_messages(None)
+        for cache in self._written_caches:
+            cache.invalidate(source=self._cache_source)
+        self._written_caches = []
+
+    def commit(self):
+        if self.sock:
+            self._commit()
             self._begin()
 
     def _rollback(self):
         if self.sock:
             self._send_message(b'Q', b"ROLLBACK\x00")
             self.process_messages(None)
+        self._written_caches = []
 
     def rollback(self):
         self._rollback()
         self.begin()
 
+    def _simple_query(self, query):
+        cur = Cursor(self)
+        cur.row_factory = None
+        # no Flush, a walsender connection accepts no other messages with replication commands
+        self._finish_streaming()
+        self._send_data(b'Q', query.encode(self.encoding) + b'\x00')
+        self.process_messages(cur)
+        return cur
+
+    def create_replication_slot(self, slot_name, plugin='pgoutput', temporary=False):
+        cur = self._simple_query('CREATE_REPLICATION_SLOT {} {}LOGICAL {}'.format(
+            slot_name, 'TEMPORARY ' if temporary else '', plugin
+        ))
+        return cur.fetchone()
+
+    def drop_replication_slot(self, slot_name):
+        self._simple_query('DROP_REPLICATION_SLOT {}'.format(slot_name))
+
+    def start_replication(self, slot_name, publication_names, start_lsn=0, status_interval=10):
+        if isinstance(start_lsn, str):
+            start_lsn = _str_to_lsn(start_lsn)
+        if not isinstance(publication_names, str):
+            publication_names = ','.join(publication_names)
+        # no Flush, the walsender accepts only CopyData, CopyDone and Terminate while streaming
+        self._finish_streaming()
+        self._send_data(b'Q', "START_REPLICATION SLOT {} LOGICAL {} (proto_version '1', publication_names {})".format(
+            slot_name, _lsn_to_str(start_lsn), self.escape_parameter(publication_names)
+        ).encode(self.encoding) + b'\x00')
+        self.process_messages(None)
+        return ReplicationStream(self, start_lsn, status_interval)
+
+    def fastpath(self, func_oid, args):
+        # args are bytes in binary format or None, returns bytes in binary format
+        self._finish_streaming()
+        parts = [_bint_to_bytes(func_oid), b'\x00\x01\x00\x01', bytes([len(args) >> 8, len(args) & 0xff])]
+        for arg in args:
+            if arg is None:
+                parts.append(b'\xff\xff\xff\xff')
+            else:
+                parts.append(_bint_to_bytes(len(arg)))
+                parts.append(arg)
+        parts.append(b'\x00\x01')
+        self._write(b'F' + _bint_to_bytes(sum([len(p) for p in parts]) + 4))
+        buf = []
+        for p in parts:
+            if len(p) > 8192:
+                self._write(b''.join(buf))
+                self._write(p)
+                buf = []
+            else:
+                # MicroPython joins only bytes, LObject.write() passes memoryview
+                buf.append(p if isinstance(p, bytes) else bytes(p))
+        self._write(b''.join(buf))
+        result = []
+        self.process_messages(result)
+        return result[0] if result else None
+
+    def _lo_call(self, name, args):
+        if not self._lo_functions:
+            cur = self._simple_query(
+                "SELECT proname, oid FROM pg_catalog.pg_proc WHERE proname IN ("
+                "'lo_open', 'lo_close', 'lo_creat', 'lo_unlink', 'loread', 'lowrite', "
+                "'lo_lseek64', 'lo_tell64', 'lo_truncate64') "
+                "AND pronamespace = 'pg_catalog'::regnamespace"
+            )
+            self._lo_functions = dict(cur.fetchall())
+        if self._ready_for_query != b'T':
+            self.begin()
+        return self.fastpath(self._lo_functions[name], args)
+
+    def lo_create(self):
+        return _bytes_to_bint(self._lo_call('lo_creat', (_bint_to_bytes(0x60000), )))
+
+    def lo_open(self, oid, mode='r'):
+        flags = (0x40000 if 'r' in mode else 0) | (0x20000 if 'w' in mode else 0)
+        fd = _bytes_to_bint(self._lo_call('lo_open', (_bint_to_bytes(oid), _bint_to_bytes(flags))))
+        return LObject(self, oid, fd)
+
+    def lo_unlink(self, oid):
+        self._lo_call('lo_unlink', (_bint_to_bytes(oid), ))
+
     def reopen(self):
         self.close()
         self._open()
@@ -783,13 +2117,283 @@ class Connection(object):
     def close(self):
         if self.sock:
             # send Terminate
-            self._write(b'X\x00\x00\x00\x04')
+            try:
+                self._write(b'X\x00\x00\x00\x04')
+            except OSError:
+                pass
             self.sock.close()
             self.sock = None
 
 
-def connect(host, user, password='', database=None, port=None, timeout=None, use_ssl=False):
-    return Connection(user, password, database, host, port if port else 5432, timeout, use_ssl)
+class SplitConnection(object):
+    # Route read-only cursors to a standby and the others to the primary.
+    def __init__(self, primary, standby):
+        self.primary = primary
+        self.standby = standby
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def cursor(self, readonly=False):
+        if readonly:
+            return self.standby.cursor()
+        return self.primary.cursor()
+
+    def set_autocommit(self, autocommit):
+        self.primary.set_autocommit(autocommit)
+        self.standby.set_autocommit(autocommit)
+
+    def commit(self):
+        self.primary.commit()
+        self.standby.commit()
+
+    def rollback(self):
+        self.primary.rollback()
+        self.standby.rollback()
+
+    def close(self):
+        self.primary.close()
+        self.standby.close()
+
+
+def connect(host, user, password='', database=None, port=None, timeout=None, use_ssl=False, target_session_attrs='any', sslnegotiation='postgres', replication=None, parameters=None, options=None):
+    return Connection(user, password, database, host, port if port else 5432, timeout, use_ssl, target_session_attrs, sslnegotiation, replication, parameters, options)
+
+
+def connect_split(host, user, password='', database=None, port=None, timeout=None, use_ssl=False, sslnegotiation='postgres', parameters=None, options=None):
+    return SplitConnection(
+        connect(host, user, password, database, port, timeout, use_ssl, 'read-write', sslnegotiation, None, parameters, options),
+        connect(host, user, password, database, port, timeout, use_ssl, 'prefer-standby', sslnegotiation, None, parameters, options),
+    )
+
+
+def _ticks_ms():
+    import time
+    if hasattr(time, 'ticks_ms'):
+        return time.ticks_ms()
+    return int(time.time() * 1000)
+
+
+def _ticks_elapsed(start):     # seconds since start returned by _ticks_ms()
+    import time
+    if hasattr(time, 'ticks_diff'):
+        return time.ticks_diff(time.ticks_ms(), start) / 1000
+    return (_ticks_ms() - start) / 1000
+
+
+def _run_threads(funcs):
+    # Run each function in its own thread, wait for all and raise the first error.
+    import _thread
+    errors = []
+    locks = []
+
+    def run(func, lock):
+        try:
+            func()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            lock.release()
+
+    for func in funcs:
+        lock = _thread.allocate_lock()
+        lock.acquire()
+        locks.append(lock)
+        _thread.start_new_thread(run, (func, lock))
+    for lock in locks:
+        lock.acquire()
+    if errors:
+        raise errors[0]
+
+
+class QueryFuture(object):
+    # Result of a query submitted to an Executor, elapsed is the seconds the query took.
+    def __init__(self, query, args):
+        import _thread
+        self.query = query
+        self.args = args
+        self.description = None
+        self.rows = None
+        self.rowcount = -1
+        self.elapsed = None
+        self._error = None
+        self._done = False
+        self._lock = _thread.allocate_lock()
+        self._lock.acquire()
+
+    def done(self):
+        return self._done
+
+    def wait(self, timeout=None):
+        if self._done:
+            return True
+        if timeout is None:
+            self._lock.acquire()
+        elif not self._lock.acquire(1, timeout):
+            return False
+        self._lock.release()
+        return True
+
+    def exception(self, timeout=None):
+        if not self.wait(timeout):
+            raise OperationalError("timeout")
+        return self._error
+
+    def result(self, timeout=None):
+        if self.exception(timeout):
+            raise self._error
+        return self.rows
+
+
+class Executor(object):
+    # Run queries concurrently over size connections, one thread per busy connection.
+    # Queries submitted while all connections are busy wait for a free one.
+    # kwargs are passed to connect().
+    def __init__(self, size=4, **kwargs):
+        import _thread
+        self._conns = []
+        self._queue = []
+        self._futures = []
+        self._closed = False
+        self._mutex = _thread.allocate_lock()
+        try:
+            for _ in range(size):
+                self._conns.append(connect(**kwargs))
+        except Exception:
+            self.close()
+            raise
+        for conn in self._conns:
+            conn.set_autocommit(True)
+        self._idle = list(self._conns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, traceback):
+        self.close()
+
+    def submit(self, query, args=None):
+        import _thread
+        future = QueryFuture(query, args)
+        with self._mutex:
+            if self._closed:
+                raise InterfaceError("Executor is closed")
+            self._futures = [f for f in self._futures if not f._done]
+            self._futures.append(future)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                self._queue.append(future)
+                conn = None
+        if conn is not None:
+            _thread.start_new_thread(self._run, (conn, future))
+        return future
+
+    def _run(self, conn, future):
+        while future is not None:
+            cur = conn.cursor()
+            # time.time() counts whole seconds on MicroPython
+            start = _ticks_ms()
+            try:
+                cur.execute(future.query, future.args)
+                future.description = cur.description
+                future.rowcount = cur.rowcount
+                if cur.description:
+                    future.rows = cur.fetchall()
+            except Exception as e:
+                future._error = e
+            future.elapsed = _ticks_elapsed(start)
+            future._done = True
+            future._lock.release()
+            with self._mutex:
+                if self._queue:
+                    future = self._queue.pop(0)
+                else:
+                    self._idle.append(conn)
+                    future = None
+
+    def map(self, queries, timeout=None):
+        # queries are query strings or (query, args) tuples, results are in the same order
+        futures = [self.submit(q) if isinstance(q, str) else self.submit(*q) for q in queries]
+        return [f.result(timeout) for f in futures]
+
+    def close(self):
+        # wait for the running and queued queries like shutdown(wait=True)
+        with self._mutex:
+            self._closed = True
+            futures = self._futures
+            self._futures = []
+        for f in futures:
+            f.wait()
+        for conn in self._conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._conns = []
+
+
+def parallel_export(table, key, partitions, sink_factory, snapshot=True, **kwargs):
+    # Export a table with COPY TO over one connection per partition.
+    # partitions is the number of key ranges for an integer key or a list of
+    # (low, high) tuples, None means unbounded and the partition without upper bound gets NULL keys.
+    # sink_factory(i) returns a file-like object which CopyData is written to.
+    # kwargs are passed to connect().
+    coordinator = connect(**kwargs)
+    try:
+        cur = coordinator.cursor()
+        if snapshot:
+            coordinator.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cur.fetchone()[0]
+        else:
+            snapshot_id = None
+        if isinstance(partitions, int):
+            cur.execute("SELECT min({0}), max({0}) FROM {1}".format(key, table))
+            low, high = cur.fetchone()
+            if low is None or partitions < 2:
+                ranges = [(None, None)]
+            elif not isinstance(low, int):
+                raise InterfaceError("Key '%s' is not an integer, give partitions as (low, high) ranges" % (key, ))
+            else:
+                step = (high - low) // partitions + 1
+                bounds = [low + step * i for i in range(1, partitions) if low + step * i <= high]
+                ranges = list(zip([None] + bounds, bounds + [None]))
+        else:
+            ranges = list(partitions)
+
+        conns = []
+
+        def export(conn, r, sink):
+            def f():
+                if snapshot_id:
+                    conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    conn.execute("SET TRANSACTION SNAPSHOT '%s'" % (snapshot_id, ))
+                conds = []
+                if r[0] is not None:
+                    conds.append("{} >= {}".format(key, conn.escape_parameter(r[0])))
+                if r[1] is not None:
+                    conds.append("{} < {}".format(key, conn.escape_parameter(r[1])))
+                where = ' AND '.join(conds) if conds else 'TRUE'
+                if r[1] is None:
+                    where = "({}) OR {} IS NULL".format(where, key)
+                conn.execute("COPY (SELECT * FROM {} WHERE {}) TO STDOUT".format(table, where), sink)
+            return f
+
+        try:
+            for _ in ranges:
+                conns.append(connect(**kwargs))
+            sinks = [sink_factory(i) for i in range(len(ranges))]
+            _run_threads([export(conns[i], ranges[i], sinks[i]) for i in range(len(ranges))])
+        finally:
+            for conn in conns:
+                conn.close()
+    finally:
+        coordinator.close()
+    return sinks
 
 
 def create_database(database, host, user, password='', port=None, use_ssl=False):
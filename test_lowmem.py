@@ -0,0 +1,154 @@
+# Run the driver against a fake server and check the memory used while
+# streaming a result set much larger than the allocation budget.
+import gc
+import socket
+import _thread
+import micropg
+
+PORT = 54329
+ROWS = 200
+FIELD_SIZE = 8000
+BUDGET = 64 * 1024
+
+
+def _msg(code, payload=b''):
+    return code + micropg._bint_to_bytes(len(payload) + 4) + payload
+
+
+def _send(sock, b):
+    while b:
+        b = b[sock.send(b):]
+
+
+def _recv(sock, ln):
+    r = b''
+    while len(r) < ln:
+        b = sock.recv(ln - len(r))
+        if not b:
+            raise OSError('closed')
+        r += b
+    return r
+
+
+def _data_row(i, size):
+    value = (b'%08d' % i) * (size // 8)
+    return _msg(b'D', b'\x00\x02\x00\x00\x00\x01' + (b'%d' % (i % 10)) + micropg._bint_to_bytes(len(value)) + value)
+
+
+def _serve(sock):
+    conn, _ = sock.accept()
+    ln = micropg._bytes_to_bint(_recv(conn, 4))
+    _recv(conn, ln - 4)
+    _send(conn, _msg(b'R', b'\x00\x00\x00\x00') + _msg(b'S', b'server_encoding\x00UTF8\x00') + _msg(b'Z', b'I'))
+    while True:
+        code = _recv(conn, 1)
+        ln = micropg._bytes_to_bint(_recv(conn, 4))
+        query = _recv(conn, ln - 4)
+        if code == b'X':
+            break
+        elif code != b'Q':
+            continue
+        if query[:5] in (b'BEGIN', b'COMMI', b'ROLLB'):
+            _send(conn, _msg(b'C', query) + _msg(b'Z', b'I' if query[:5] != b'BEGIN' else b'T'))
+            continue
+        if query[:5] == b'error':
+            _send(conn, _msg(b'T', b'\x00\x01' + b'id\x00' + b'\x00' * 6 + b'\x00\x00\x00\x17' + b'\x00' * 8))
+            _send(conn, _msg(b'D', b'\x00\x01\x00\x00\x00\x011') * 2)
+            _send(conn, _msg(b'E', b'SERROR\x00C22012\x00Mdivision by zero\x00\x00') + _msg(b'Z', b'E'))
+            continue
+        size = FIELD_SIZE * 4 if query[:5] == b'large' else FIELD_SIZE
+        _send(conn, _msg(b'T', b'\x00\x02' + b'id\x00' + b'\x00' * 6 + b'\x00\x00\x00\x17' + b'\x00' * 8 + b'v\x00' + b'\x00' * 6 + b'\x00\x00\x00\x11' + b'\x00' * 8))
+        for i in range(ROWS):
+            _send(conn, _data_row(i, size))
+        _send(conn, _msg(b'C', b'SELECT %d\x00' % ROWS) + _msg(b'Z', b'T'))
+    conn.close()
+
+
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(socket.getaddrinfo('127.0.0.1', PORT)[0][-1])
+server.listen(1)
+_thread.start_new_thread(_serve, (server, ))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _start():
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        return 0
+    return gc.mem_alloc()
+
+
+def _peak(base, peak):
+    if tracemalloc:
+        return tracemalloc.get_traced_memory()[1]
+    # MicroPython has no allocation peak, sample the live memory without garbage
+    gc.collect()
+    return max(peak, gc.mem_alloc() - base)
+
+
+conn = micropg.connect(host='127.0.0.1', user='postgres', port=PORT)
+conn.max_field_size = FIELD_SIZE * 2
+cur = conn.cursor()
+cur.streaming = True
+cur.row_factory = micropg.lazy_row
+
+# stream the rows one by one
+base = _start()
+peak = 0
+total = 0
+cur.execute("SELECT id, v FROM test")
+for row in cur:
+    assert row[0] == total % 10
+    total += 1
+    peak = _peak(base, peak)
+    del row
+if tracemalloc:
+    tracemalloc.stop()
+assert total == ROWS
+assert cur.rowcount == ROWS
+assert ROWS * FIELD_SIZE > BUDGET * 10
+assert peak < BUDGET, peak
+
+# the rows left are discarded one by one when the cursor is executed again
+cur.execute("SELECT id, v FROM test")
+assert cur.fetchone()[0] == 0
+base = _start()
+cur.execute("SELECT id, v FROM test")
+peak = _peak(base, 0)
+if tracemalloc:
+    tracemalloc.stop()
+assert peak < BUDGET, peak
+assert len([row for row in cur]) == ROWS
+
+# fields over max_field_size are skipped without allocation and raise DataError
+cur.streaming = False
+try:
+    cur.execute("large")
+    assert False
+except micropg.DataError:
+    pass
+
+# the cursor keeps streaming after an error in the middle of the rows
+cur.streaming = True
+cur.row_factory = None
+cur.execute("error")
+assert cur.fetchone() == (1, )
+try:
+    cur.fetchall()
+    assert False
+except micropg.DatabaseError:
+    pass
+assert cur.streaming
+cur.row_factory = micropg.lazy_row
+cur.execute("SELECT id, v FROM test")
+assert len(cur.fetchone()) == 2
+cur.fetchall()
+
+conn.close()
+server.close()
@@ -1,3 +1,5 @@
+import io
+import os
 import micropg
 
 try:
@@ -34,21 +36,292 @@ cur.execute("""
 
 cur.execute("INSERT INTO test_micropg(id, name) values (1, 'test')")
 cur.execute("INSERT INTO test_micropg(id, name) values (%s, %s)", [2, 'test2'])
+cur.execute_values(
+    "INSERT INTO test_micropg(id, name) VALUES %s RETURNING id",
+    [(i, 'values%d' % i) for i in range(3, 8)], page_size=2
+)
+assert cur.rowcount == 5
+assert cur.fetchall() == [(3, ), (4, ), (5, ), (6, ), (7, )]
+cur.execute_values(
+    "INSERT INTO test_micropg(id, name) SELECT id::integer, name || '%%s' FROM (VALUES %s) v(id, name) RETURNING name",
+    [(8, 'a')]
+)
+assert cur.fetchall() == [('a%s', )]
+try:
+    cur.execute_values("INSERT INTO test_micropg(id, name) VALUES %s", [(9, 'b'), None])
+    assert False
+except TypeError:
+    pass
+cur.execute_values("INSERT INTO test_micropg(id, name) VALUES %s RETURNING id", [])
+assert cur.description == [] and cur.rowcount == 0 and cur.fetchall() == []
+cur.streaming = True
+cur.execute_values(
+    "INSERT INTO test_micropg(id, name) VALUES %s RETURNING id", [(9, 'b'), (10, 'c'), (11, 'd')], page_size=2
+)
+assert cur.rowcount == 3 and cur.fetchall() == [(9, ), (10, ), (11, )]
+cur.streaming = False
+cur.execute("DELETE FROM test_micropg WHERE id >= 3")
+
+# bulk upsert
+cur.execute("CREATE UNIQUE INDEX test_micropg_id ON test_micropg (id)")
+assert cur.bulk_upsert('test_micropg', ['id'], [(3, )], ['id']) == 1
+n = cur.bulk_upsert(
+    'test_micropg', ['id', 'name'],
+    [(2, 'upsert2'), (3, 'a\tb\\c\nd'), (4, None), (4, 'upsert4')], ['id'], chunk_size=3
+)
+assert n == 4    # 3 rows in the first chunk, 1 in the second
+cur.execute("SELECT id, name FROM test_micropg WHERE id >= 2 ORDER BY id")
+assert cur.fetchall() == [(2, 'upsert2'), (3, 'a\tb\\c\nd'), (4, 'upsert4')]
+assert cur.bulk_upsert('test_micropg', ['id', 'name'], [(2, 'test2')], ['id'], update_columns=[]) == 0
+cur.execute("UPDATE test_micropg SET name = 'test2' WHERE id = 2")
+cur.execute("DELETE FROM test_micropg WHERE id >= 3")
 
 conn.commit()
 
+# an error producing the COPY data aborts the COPY and the connection stays usable
+try:
+    cur.bulk_upsert('test_micropg', ['id'], [(5, ), None], ['id'])
+    assert False
+except TypeError:
+    pass
+conn.rollback()
+
 cur.execute("SELECT id, name FROM test_micropg")
 assert cur.fetchall() == [(1, "test"), (2, "test2")]
 
+# row factory
+cur.row_factory = micropg.compact_row
+cur.execute("SELECT id, name FROM test_micropg")
+rows = cur.fetchall()
+assert rows == [(1, "test"), (2, "test2")]
+assert rows[1].name == "test2" and rows[1]['id'] == 2
+assert rows[0] != None and not rows[0] == 1 and rows[0] != [1, "test"]
+assert hash(rows[0]) == hash((1, "test"))
+cur.row_factory = micropg.lazy_row
+cur.execute("SELECT id, name FROM test_micropg")
+rows = cur.fetchall()
+assert rows[1].name == "test2" and rows == [(1, "test"), (2, "test2")]
+assert rows[0] != None and not rows[0] == 1 and rows[0] != [1, "test"]
+assert hash(rows[0]) == hash((1, "test"))
+cur.row_factory = micropg.dict_row
+cur.execute("SELECT id, name FROM test_micropg")
+assert cur.fetchall() == [{'id': 1, 'name': "test"}, {'id': 2, 'name': "test2"}]
+cur.row_factory = None
+
+# copy from file
+with open('test_micropg.tsv', 'wb') as f:
+    f.write(b'10\tcopy10\n11\tcopy11\n')
+cur.copy_from_file('test_micropg.tsv', 'test_micropg', columns=['id', 'name'])
+assert cur.rowcount == 2
+cur.execute("SELECT name FROM test_micropg WHERE id >= 10 ORDER BY id")
+assert cur.fetchall() == [('copy10', ), ('copy11', )]
+cur.execute("DELETE FROM test_micropg WHERE id >= 10")
+os.remove('test_micropg.tsv')
+
+# multiple result sets
+cur.execute("SELECT id FROM test_micropg ORDER BY id; SELECT name FROM test_micropg WHERE id=2")
+assert cur.fetchall() == [(1, ), (2, )]
+assert cur.nextset()
+assert cur.description[0][0] == 'name'
+assert cur.fetchall() == [('test2', )]
+assert cur.nextset() is None
+
+# streaming
+cur.streaming = True
+cur.execute("SELECT id, name FROM test_micropg ORDER BY id")
+assert cur.fetchone() == (1, "test")
+assert [r for r in cur] == [(2, "test2")]
+cur.streaming = False
+
+# stream columns to sinks
+text_sink = io.BytesIO()
+bytea_sink = io.BytesIO()
+cur.column_sinks = {0: text_sink, 'b': bytea_sink}
+cur.execute("SELECT repeat('x', 100000), decode(repeat('0102', 50000), 'hex') AS b, 1")
+assert cur.fetchall() == [(100000, 100000, 1)]
+assert text_sink.getvalue() == b'x' * 100000
+assert bytea_sink.getvalue() == b'\x01\x02' * 50000
+cur.column_sinks = {'b': bytea_sink}     # not in the result
+cur.execute("SELECT 1")
+assert cur.fetchall() == [(1, )]
+cur.column_sinks = {'b': lambda row_number: 1 / 0}
+try:
+    cur.execute("SELECT 'x' AS b UNION ALL SELECT 'y'")
+    assert False
+except ZeroDivisionError:
+    pass
+cur.column_sinks = {}
+cur.execute("SELECT 1")     # the connection is in sync after the error of a sink
+assert cur.fetchall() == [(1, )]
+
+# query cache
+conn.set_autocommit(True)
+conn.query_cache = micropg.QueryCache()
+cur = conn.cursor()
+cur.execute("SELECT id, name FROM test_micropg WHERE id=%s", [1])
+cur.execute("SELECT id, name FROM test_micropg WHERE id=%s", [1])
+assert cur.fetchall() == [(1, "test")]
+assert (conn.query_cache.hits, conn.query_cache.misses) == (1, 1)
+cur.execute("SELECT id, name FROM test_micropg WHERE id=1 FOR UPDATE")
+assert (conn.query_cache.hits, conn.query_cache.misses) == (1, 1)
+cur.row_factory = micropg.dict_row
+cur.execute("SELECT id, name FROM test_micropg WHERE id=2")
+cur.fetchone()['name'] = 'changed'
+cur.execute("SELECT id, name FROM test_micropg WHERE id=2")
+assert cur.fetchall() == [{'id': 2, 'name': "test2"}]
+cur.execute("UPDATE test_micropg SET name='changed' WHERE id=2")
+cur.execute("SELECT id, name FROM test_micropg WHERE id=2")
+assert cur.fetchall() == [{'id': 2, 'name': "changed"}]
+cur.execute("UPDATE test_micropg SET name='test2' WHERE id=2")
+conn.set_autocommit(False)
+cur.execute("SELECT id, name FROM test_micropg WHERE id=2")
+cur.execute("SELECT id, name FROM test_micropg WHERE id=2")
+assert (conn.query_cache.hits, conn.query_cache.misses) == (2, 3)    # not cached in a transaction
+conn.commit()
+conn.query_cache = None
+cur = conn.cursor()
+
+# large object
+oid = conn.lo_create()
+with conn.lo_open(oid, 'rw') as lo:
+    assert lo.write(b'0123456789' * 10000) == 100000
+    lo.seek(10)
+    buf = bytearray(5)
+    assert lo.readinto(buf) == 5 and buf == b'01234'
+    lo.truncate(20)
+    lo.seek(0)
+    assert lo.read() == b'01234567890123456789'
+    lo.seek(0)
+    assert lo.write(b'abc') == 3
+    lo.seek(0)
+    assert lo.read(5) == b'abc34'
+conn.lo_unlink(oid)
+conn.commit()
+
+# LISTEN/NOTIFY
+conn.set_autocommit(True)
+cur.execute("LISTEN test_channel")
+cur.execute("NOTIFY test_channel, 'payload'")
+assert conn.wait_notify(5)[1:] == ('test_channel', 'payload')
+assert conn.wait_notify(0.1) is None
+conn.set_autocommit(False)
+
 conn.close()
 
-if False:   # disable ssl connection
-    # test ssl connection
+# target_session_attrs and startup parameters
+conn = micropg.connect(
+    host='127.0.0.1', user='postgres', password='password', database='test_micropg',
+    target_session_attrs='read-write',
+    parameters={'application_name': 'test_micropg', 'search_path': u'public, "sch\u00e9ma"'},
+    options='-c statement_timeout=10s'
+)
+assert conn.parameter_status['application_name'] == 'test_micropg'
+if 'search_path' in conn.parameter_status:     # reported since PostgreSQL 18
+    assert conn.parameter_status['search_path'] == u'public, "sch\u00e9ma"'
+assert conn.get_parameter_status('statement_timeout') == '10s'
+conn.execute("SET statement_timeout = 5000")
+assert conn.get_parameter_status('statement_timeout') == '5s'
+assert conn.isolation_level == 'read committed'
+cur = conn.cursor()
+cur.execute("SELECT id, name FROM test_micropg")
+assert cur.fetchall() == [(1, "test"), (2, "test2")]
+conn.close()
+
+# multiple hosts, nothing listens on port 1 and 2
+conn = micropg.connect(
+    host='127.0.0.1:1,127.0.0.1', user='postgres', password='password', database='test_micropg'
+)
+cur = conn.cursor()
+cur.execute("SELECT count(*) FROM test_micropg")
+assert cur.fetchall() == [(2, )]
+conn.close()
+conn = micropg.connect(
+    host=['127.0.0.1:1', '127.0.0.1'], user='postgres', password='password', database='test_micropg',
+    target_session_attrs='prefer-standby'
+)
+cur = conn.cursor()
+cur.execute("SELECT pg_is_in_recovery()")
+assert cur.fetchall() == [(False, )]     # no standby, falls back to the primary
+conn.close()
+try:
+    micropg.connect(
+        host='127.0.0.1:1,127.0.0.1:2', user='postgres', password='password', database='test_micropg'
+    )
+    assert False
+except micropg.OperationalError:
+    pass
+
+# parallel export
+sinks = micropg.parallel_export(
+    'test_micropg', 'id', 2, lambda i: io.BytesIO(),
+    host='127.0.0.1', user='postgres', password='password', database='test_micropg'
+)
+assert sorted(b''.join(s.getvalue() for s in sinks).splitlines()) == [b'1\ttest', b'2\ttest2']
+sinks = micropg.parallel_export(
+    'test_micropg', 'name', [(None, 'test2'), ('test2', None)], lambda i: io.BytesIO(),
+    host='127.0.0.1', user='postgres', password='password', database='test_micropg'
+)
+assert [s.getvalue() for s in sinks] == [b'1\ttest\n', b'2\ttest2\n']
+try:
+    micropg.parallel_export(
+        'test_micropg', 'name', 2, lambda i: io.BytesIO(),
+        host='127.0.0.1', user='postgres', password='password', database='test_micropg'
+    )
+    assert False
+except micropg.InterfaceError:
+    pass
+
+# executor
+with micropg.Executor(2, host='127.0.0.1', user='postgres', password='password', database='test_micropg') as ex:
+    results = ex.map([
+        "SELECT name FROM test_micropg WHERE id = 1",
+        ("SELECT name FROM test_micropg WHERE id = %s", [2]),
+        "SELECT pg_sleep(0.1)",
+    ])
+    assert results[:2] == [[("test", )], [("test2", )]]
+    f = ex.submit("BAD STATEMENT")
+    assert isinstance(f.exception(), micropg.ProgrammingError)
+    f = ex.submit("SELECT count(*) FROM test_micropg")
+    assert f.result() == [(2, )] and f.done() and f.elapsed >= 0
+    f = ex.submit("SELECT pg_sleep(0.2)")
+    assert f.exception() is None and 0.15 <= f.elapsed < 5
+    futures = [ex.submit("SELECT pg_sleep(0.1)") for _ in range(3)]
+assert all(f.done() and f.exception() is None for f in futures)
+try:
+    ex.submit("SELECT 1")
+    assert False
+except micropg.InterfaceError:
+    pass
+
+# ssl connection, skipped when the server does not accept SSL
+try:
     conn = micropg.connect(
         host='127.0.0.1', user='postgres', password='password', database='test_micropg', use_ssl=True
     )
+except micropg.InterfaceError:
+    conn = None
+if conn:
     cur = conn.cursor()
     cur.execute("SELECT id, name FROM test_micropg")
     assert cur.fetchall() == [(1, "test"), (2, "test2")]
+    major = int(conn.get_parameter_status('server_version').split('.')[0])
+    conn.close()
 
+    # reconnect with the TLS session saved by the previous connection
+    conn = micropg.connect(
+        host='127.0.0.1', user='postgres', password='password', database='test_micropg', use_ssl=True
+    )
+    cur = conn.cursor()
+    cur.execute("SELECT ssl FROM pg_stat_ssl WHERE pid = pg_backend_pid()")
+    assert cur.fetchall() == [(True, )]
     conn.close()
+
+    if major >= 17:
+        conn = micropg.connect(
+            host='127.0.0.1', user='postgres', password='password', database='test_micropg',
+            use_ssl=True, sslnegotiation='direct'
+        )
+        cur = conn.cursor()
+        cur.execute("SELECT id, name FROM test_micropg")
+        assert cur.fetchall() == [(1, "test"), (2, "test2")]
+        conn.close()
@@ -0,0 +1,134 @@
+# Run logical replication against a fake walsender and check the pgoutput
+# decoding and the messages sent by the client while streaming.
+import socket
+import _thread
+import micropg
+
+PORT = 54330
+RELID = 16384
+KEEPALIVE_LSN = 0x1000020
+received = []
+
+
+def _msg(code, payload=b''):
+    return code + micropg._bint_to_bytes(len(payload) + 4) + payload
+
+
+def _send(sock, b):
+    while b:
+        b = b[sock.send(b):]
+
+
+def _recv(sock, ln):
+    r = b''
+    while len(r) < ln:
+        b = sock.recv(ln - len(r))
+        if not b:
+            raise OSError('closed')
+        r += b
+    return r
+
+
+def _lsn(n):
+    return n.to_bytes(8, 'big')
+
+
+def _tuple(values):
+    r = len(values).to_bytes(2, 'big')
+    for v in values:
+        if v is None:
+            r += b'n'
+        else:
+            r += b't' + micropg._bint_to_bytes(len(v)) + v
+    return r
+
+
+def _xlog(lsn, payload):
+    return _msg(b'd', b'w' + _lsn(lsn) + _lsn(lsn + 8) + _lsn(0) + payload)
+
+
+def _stream(conn):
+    relid = micropg._bint_to_bytes(RELID)
+    _send(conn, _msg(b'W', b'\x00\x00\x00'))
+    _send(conn, _msg(b'd', b'k' + _lsn(KEEPALIVE_LSN) + _lsn(0) + b'\x01'))
+    _send(conn, _xlog(0x1000100, b'B' + _lsn(0x1000200) + _lsn(12345) + micropg._bint_to_bytes(700)))
+    _send(conn, _xlog(0x1000110, b'R' + relid + b'public\x00test\x00d' + b'\x00\x02' +
+                      b'\x01id\x00' + micropg._bint_to_bytes(23) + b'\xff\xff\xff\xff' +
+                      b'\x00name\x00' + micropg._bint_to_bytes(25) + b'\xff\xff\xff\xff'))
+    _send(conn, _xlog(0x1000120, b'I' + relid + b'N' + _tuple([b'1', b'foo'])))
+    _send(conn, _xlog(0x1000130, b'U' + relid + b'O' + _tuple([b'1', b'foo']) + b'N' + _tuple([b'1', None])))
+    _send(conn, _xlog(0x1000140, b'D' + relid + b'K' + _tuple([b'1', None])))
+    _send(conn, _xlog(0x1000150, b'C' + b'\x00' + _lsn(0x1000200) + _lsn(0x1000208) + _lsn(12345)))
+    while True:
+        code = _recv(conn, 1)
+        data = _recv(conn, micropg._bytes_to_bint(_recv(conn, 4)) - 4)
+        received.append((code, data))
+        if code == b'c':
+            _send(conn, _msg(b'c') + _msg(b'C', b'START_REPLICATION\x00') + _msg(b'Z', b'I'))
+        elif code != b'd':
+            break
+
+
+def _serve(sock):
+    conn, _ = sock.accept()
+    ln = micropg._bytes_to_bint(_recv(conn, 4))
+    _recv(conn, ln - 4)
+    _send(conn, _msg(b'R', b'\x00\x00\x00\x00') + _msg(b'S', b'server_encoding\x00UTF8\x00') + _msg(b'Z', b'I'))
+    while True:
+        code = _recv(conn, 1)
+        query = _recv(conn, micropg._bytes_to_bint(_recv(conn, 4)) - 4)
+        if code == b'X':
+            break
+        elif code != b'Q':
+            # like a walsender, which accepts no Flush
+            _send(conn, _msg(b'E', b'SFATAL\x00C08P01\x00Minvalid standby message type\x00\x00'))
+            break
+        if query.startswith(b'START_REPLICATION'):
+            _stream(conn)
+            break
+        elif query.startswith(b'CREATE_REPLICATION_SLOT'):
+            _send(conn, _msg(b'T', b'\x00\x02' +
+                             b'slot_name\x00' + b'\x00' * 6 + micropg._bint_to_bytes(25) + b'\xff\xff\xff\xff\x00\x00\x00\x00' +
+                             b'consistent_point\x00' + b'\x00' * 6 + micropg._bint_to_bytes(25) + b'\xff\xff\xff\xff\x00\x00\x00\x00'))
+            _send(conn, _msg(b'D', b'\x00\x02' + micropg._bint_to_bytes(9) + b'test_slot' +
+                             micropg._bint_to_bytes(9) + b'0/1000000'))
+            _send(conn, _msg(b'C', b'CREATE_REPLICATION_SLOT\x00'))
+        else:
+            _send(conn, _msg(b'C', query))
+        _send(conn, _msg(b'Z', b'I'))
+    conn.close()
+
+
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(socket.getaddrinfo('127.0.0.1', PORT)[0][-1])
+server.listen(1)
+_thread.start_new_thread(_serve, (server, ))
+
+conn = micropg.connect(host='127.0.0.1', user='postgres', port=PORT, replication='database')
+assert conn.create_replication_slot('test_slot') == ('test_slot', '0/1000000')
+conn.drop_replication_slot('old_slot')
+stream = conn.start_replication('test_slot', ['test_pub'], start_lsn='0/1000000')
+messages = [next(stream) for _ in range(6)]
+stream.close()
+
+assert [m.kind for m in messages] == ['begin', 'relation', 'insert', 'update', 'delete', 'commit']
+assert messages[0].final_lsn == 0x1000200 and messages[0].xid == 700
+assert messages[1].relation == ('public', 'test', [('id', 23), ('name', 25)])
+assert messages[2].new == {'id': 1, 'name': 'foo'} and messages[2].old is None
+assert messages[3].old == {'id': 1, 'name': 'foo'} and messages[3].new == {'id': 1, 'name': None}
+assert messages[4].old == {'id': 1, 'name': None} and messages[4].new is None
+assert messages[5].commit_lsn == 0x1000200 and messages[5].end_lsn == 0x1000208
+assert messages[5].data_start == 0x1000150
+assert stream.received_lsn == 0x1000158
+
+# only CopyData and CopyDone while streaming
+assert [code for code, data in received] == [b'd', b'd', b'c'], received
+# the initial status update and the reply to the keepalive requesting it
+feedback = [data for code, data in received if code == b'd']
+assert [data[:1] for data in feedback] == [b'r', b'r']
+assert micropg._bytes_to_bint(feedback[0][1:9]) == 0x1000000
+assert micropg._bytes_to_bint(feedback[1][1:9]) == KEEPALIVE_LSN
+
+conn.close()
+server.close()